@@ -1,10 +1,9 @@
 import time
-import random
-import csv
-import os
-from datetime import datetime
 
-from utils.TCP import RHX_TCPClient
+import numpy as np
+
+from utils.TCP import RHX_TCPClient, COMMAND_SEPARATOR, RUN, STOP
+from utils.log_time import create_csv_logger, log_to_csv
 
 # ----------------------------------------------------------------------
 # Configuration / Parameters
@@ -18,53 +17,51 @@ DURATION = 660      # Duration of the pulse in microseconds
 OUTPUT_FOLDER = "timing"
 STIMULATION_TIME = 10  # how long (in seconds) the board is run with these stim parameters
 
+# List of channels to iterate over
+CHANNELS = [f"a-{i:03d}" for i in range(CHANNEL_START, CHANNEL_END + 1)]
+
 
 # ======================================================================
 # Run the Stimulation
 # ======================================================================
 
-# Function to create CSV logger
-def create_csv_logger(output_folder):
-    if not os.path.exists(output_folder):
-        os.makedirs(output_folder)
-    filename = datetime.now().strftime("%Y-%m-%d_%H-%M-%S") + ".csv"
-    filepath = os.path.join(output_folder, filename)
-    with open(filepath, mode='w', newline='') as file:
-        writer = csv.writer(file)
-        writer.writerow(["Date-Time", "Main Channel", "Return Channel", "Amplitude (uA)"])
-    return filepath
-
-# Function to log data to CSV
-def log_to_csv(filepath, main_channel, return_channel, amplitude):
-    with open(filepath, mode='a', newline='') as file:
-        writer = csv.writer(file)
-        writer.writerow([
-            datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            main_channel,
-            return_channel,
-            amplitude
-        ])
-
-if __name__ == "__main__":
-    client = RHX_TCPClient(host="127.0.0.1", port=5000)
-    csv_file = create_csv_logger(OUTPUT_FOLDER)
-
-    # List of channels to iterate over
-    channels = [f"a-{str(i).zfill(3)}" for i in range(CHANNEL_START, CHANNEL_END + 1)]
-
-    # List of current values to iterate over (amplitudes)
-    current_values = list(range(CURRENT_START, CURRENT_END + 1, CURRENT_INCREMENT))
+# Function to build a channel's pre-encoded configuration block, split around the
+# amplitude so filling it in is a plain concatenation
+def build_channel_template(channel, polarity):
+    block = COMMAND_SEPARATOR.join([
+        f"set {channel}.stimenabled true",
+        f"set {channel}.shape monophasic",
+        f"set {channel}.polarity {polarity}",
+        f"set {channel}.source KeyPressF1",
+        f"set {channel}.firstphasedurationmicroseconds {DURATION}",
+        f"set {channel}.firstphaseamplitudemicroamps {{amplitude}}",
+        f"set {channel}.numberofstimpulses 1",
+        f"set {channel}.pulsetrainperiodmicroseconds 10000",
+    ]).encode('utf-8')
+    prefix, suffix = block.split(b"{amplitude}")
+    return prefix, suffix
+
+# Function to run the full sweep: every amplitude over every (main, return) channel pair
+def run_sweep(client, csv_file, channels, current_values):
+    # Configuration blocks for each channel as main (positive) and return (negative)
+    MAIN_CMDS = {ch: build_channel_template(ch, "PositiveFirst") for ch in channels}
+    RETURN_CMDS = {ch: build_channel_template(ch, "NegativeFirst") for ch in channels}
+    DISABLE_CMDS = {ch: f"set {ch}.stimenabled false".encode('utf-8') for ch in channels}
 
     # Variables to keep track of previously enabled channels (so we can disable them)
     previous_main_channel = None
     previous_return_channel = None
 
+    # Randomise the amplitude order once up front
+    rng = np.random.default_rng()
+    current_values = rng.permutation(list(current_values)).tolist()
+
     try:
         # We will keep picking amplitudes until we exhaust 'current_values'
         while current_values:
-            # Randomly select an amplitude and remove it from the list
-            amplitude = random.choice(current_values)
-            current_values.remove(amplitude)
+            # Take the next amplitude from the shuffled list
+            amplitude = current_values.pop()
+            amplitude_bytes = str(amplitude).encode('utf-8')
 
             # Now iterate through each channel in sequence
             for i in range(len(channels)):
@@ -81,41 +78,25 @@ if __name__ == "__main__":
                       f"Amplitude: {amplitude} µA")
 
                 # Disable previously used channels before configuring new ones
-                if previous_main_channel:
-                    client.send_command(f"set {previous_main_channel}.stimenabled false")
-                if previous_return_channel:
-                    client.send_command(f"set {previous_return_channel}.stimenabled false")
-
-                # -----------------------------
-                # CONFIGURE MAIN (POSITIVE) CHANNEL
-                # -----------------------------
-                client.send_command(f"set {main_channel}.stimenabled true")
-                client.send_command(f"set {main_channel}.shape monophasic")
-                client.send_command(f"set {main_channel}.polarity PositiveFirst")
-                client.send_command(f"set {main_channel}.source KeyPressF1")
-                client.send_command(f"set {main_channel}.firstphasedurationmicroseconds {DURATION}")
-                client.send_command(f"set {main_channel}.firstphaseamplitudemicroamps {amplitude}")
-                client.send_command(f"set {main_channel}.numberofstimpulses 1")
-                client.send_command(f"set {main_channel}.pulsetrainperiodmicroseconds 10000")
-
-                # -----------------------------
-                # CONFIGURE RETURN (NEGATIVE) CHANNEL
-                # -----------------------------
-                client.send_command(f"set {return_channel}.stimenabled true")
-                client.send_command(f"set {return_channel}.shape monophasic")
-                client.send_command(f"set {return_channel}.polarity NegativeFirst")
-                client.send_command(f"set {return_channel}.source KeyPressF1")
-                client.send_command(f"set {return_channel}.firstphasedurationmicroseconds {DURATION}")
-                client.send_command(f"set {return_channel}.firstphaseamplitudemicroamps {amplitude}")
-                client.send_command(f"set {return_channel}.numberofstimpulses 1")
-                client.send_command(f"set {return_channel}.pulsetrainperiodmicroseconds 10000")
+                # (same block, so the server sees the whole change at once)
+                cmds = [DISABLE_CMDS[ch] for ch in (previous_main_channel, previous_return_channel) if ch]
+
+                # Configure main (positive) and return (negative) channels
+                main_prefix, main_suffix = MAIN_CMDS[main_channel]
+                return_prefix, return_suffix = RETURN_CMDS[return_channel]
+                cmds += [
+                    main_prefix + amplitude_bytes + main_suffix,
+                    return_prefix + amplitude_bytes + return_suffix,
+                ]
 
                 # Upload parameters and run
-                client.send_command("execute uploadstimparameters")
-                client.send_command("set runmode run")
+                cmds += [b"execute uploadstimparameters", RUN]
 
                 # Trigger the pulses (acts as if F1 is being pressed)
-                client.send_command("execute manualstimtriggerpulse F1")
+                cmds.append(b"execute manualstimtriggerpulse F1")
+
+                # Send the whole configuration block in one go
+                client.send_commands(cmds)
 
                 # Log the stimulation attempt
                 log_to_csv(csv_file, main_channel, return_channel, amplitude)
@@ -123,22 +104,43 @@ if __name__ == "__main__":
                 # Wait for the stimulation duration
                 time.sleep(STIMULATION_TIME)
 
+                # Report anything the server sent back for the block above (errors for
+                # rejected commands); this also keeps the runmode reply below clean
+                replies = client.drain_responses(timeout=0)
+                if replies:
+                    print(f"Server replies: {replies}")
+
                 # Stop the board
-                client.send_command("set runmode stop")
+                client.send_command(STOP)
 
                 # Remember these so we can disable them on the next loop iteration
                 previous_main_channel = main_channel
                 previous_return_channel = return_channel
 
-                # Short pause
-                time.sleep(1)
+                # Wait for the server to confirm the stop (it answers in order, so
+                # a reply means everything above has been processed)
+                client.send_command("get runmode", wait_response=True)
 
-    except KeyboardInterrupt:
-        print("Process interrupted by user.")
+            # Write out this amplitude's log rows
+            csv_file.flush()
     finally:
         # Disable any channels that might be left enabled
         if previous_main_channel:
             client.send_command(f"set {previous_main_channel}.stimenabled false")
         if previous_return_channel:
             client.send_command(f"set {previous_return_channel}.stimenabled false")
+
+if __name__ == "__main__":
+    client = RHX_TCPClient(host="127.0.0.1", port=5000)
+    csv_file = create_csv_logger(OUTPUT_FOLDER, ["Main Channel", "Return Channel", "Amplitude (uA)"])
+
+    # List of current values to iterate over (amplitudes)
+    current_values = range(CURRENT_START, CURRENT_END + 1, CURRENT_INCREMENT)
+
+    try:
+        run_sweep(client, csv_file, CHANNELS, current_values)
+    except KeyboardInterrupt:
+        print("Process interrupted by user.")
+    finally:
         client.close()
+        csv_file.close()
@@ -1,9 +1,7 @@
 import time
-import os
-from datetime import datetime
-import csv
 
-from utils.TCP import RHX_TCPClient
+from utils.TCP import RHX_TCPClient, RUN, STOP
+from utils.log_time import create_csv_logger, log_to_csv
 
 # ======================================================================
 # Configuration Parameters
@@ -34,21 +32,6 @@ OUTPUT_FOLDER = "TI_dipole_logs"
 # Helper Functions
 # ======================================================================
 
-def create_csv_logger(output_folder):
-    if not os.path.exists(output_folder):
-        os.makedirs(output_folder)
-    filename = datetime.now().strftime("%Y-%m-%d_%H-%M-%S") + ".csv"
-    filepath = os.path.join(output_folder, filename)
-    with open(filepath, mode='w', newline='') as file:
-        writer = csv.writer(file)
-        writer.writerow(["Date-Time", "Channel", "Frequency (Hz)", "Amplitude (uA)"])
-    return filepath
-
-def log_to_csv(filepath, channel, freq, amplitude):
-    with open(filepath, mode='a', newline='') as file:
-        writer = csv.writer(file)
-        writer.writerow([datetime.now().strftime("%Y-%m-%d %H:%M:%S"), channel, freq, amplitude])
-
 def configure_channel(client, channel, amplitude_ua, phase_duration_us, interphase_delay_us):
     # Configure a single channel for one pulse per trigger
     client.send_command(f"set {channel}.stimenabled true")
@@ -65,7 +48,7 @@ def configure_channel(client, channel, amplitude_ua, phase_duration_us, interpha
 if __name__ == "__main__":
     # Connect to the Intan system
     client = RHX_TCPClient(host=HOST, port=PORT)
-    csv_file = create_csv_logger(OUTPUT_FOLDER)
+    csv_file = create_csv_logger(OUTPUT_FOLDER, ["Channel", "Frequency (Hz)", "Amplitude (uA)"])
 
     try:
         # Disable both channels first
@@ -86,34 +69,42 @@ if __name__ == "__main__":
         # Log channel settings
         log_to_csv(csv_file, CHANNEL_A, FREQ_A, AMPLITUDE_UA1)
         log_to_csv(csv_file, CHANNEL_B, FREQ_B, AMPLITUDE_UA2)
+        csv_file.flush()
 
         # Start running mode
-        client.send_command("set runmode run")
+        client.send_command(RUN)
 
-        # Current time reference
-        start_time = time.time()
+        # Current time reference (monotonic, so the trigger cadence can't drift with clock changes)
+        start_time = time.perf_counter()
         next_A = start_time
         next_B = start_time
 
         # Loop for the designated stimulation time
-        while time.time() - start_time < STIMULATION_TIME:
-            now = time.time()
+        while True:
+            # Sleep until the nearest trigger deadline instead of polling
+            deadline = min(next_A, next_B)
+            if deadline - start_time >= STIMULATION_TIME:
+                break
+            time.sleep(max(0.0, deadline - time.perf_counter()))
+            now = time.perf_counter()
+
+            # Collect whichever triggers are due so they go out in a single send
+            triggers = []
 
             # Check if it's time to trigger channel A (F1)
             if now >= next_A:
-                client.send_command("execute manualstimtriggerpulse F1")
+                triggers.append("execute manualstimtriggerpulse F1")
                 next_A += PERIOD_A
 
             # Check if it's time to trigger channel B (F2)
             if now >= next_B:
-                client.send_command("execute manualstimtriggerpulse F2")
+                triggers.append("execute manualstimtriggerpulse F2")
                 next_B += PERIOD_B
 
-            # Short sleep to reduce busy waiting (adjust as needed)
-            time.sleep(1e-4)  # 100 µs sleep
+            client.send_commands(triggers, delay=0)
 
         # Stop stimulation
-        client.send_command("set runmode stop")
+        client.send_command(STOP)
         client.send_command(f"set {CHANNEL_A}.stimenabled false")
         client.send_command(f"set {CHANNEL_B}.stimenabled false")
 
@@ -123,3 +114,4 @@ if __name__ == "__main__":
         print("Process interrupted by user.")
     finally:
         client.close()
+        csv_file.close()
@@ -1,18 +1,22 @@
+import logging
 import time
+import threading
 import numpy as np
-from utils.TI import run_ti_dipole_stimulation
-from models.bo_model import BOModel
 
-from utils.read_data import read_intan_rhs_file
+# utils.TI, models.bo_model (skopt/scipy), utils.read_data and utils.metrics (numba)
+# are imported where they're used, so loading this module stays fast
+
+# One log line per iteration; set the level to WARNING to silence the loop
+logger = logging.getLogger(__name__)
 
 # ----------------------------------------------------------------------
 # Configuration / Parameters
 # ----------------------------------------------------------------------
 # Available TI channels: a00 through a011 (e.g., "a-000", "a-001", ..., "a-011")
-TI_CHANNELS = [f"a-0{str(i).zfill(2)}" for i in range(12)]
+TI_CHANNELS = [f"a-{i:03d}" for i in range(12)]
 
 # We assume we have 128 recording channels (e.g., "r-000", "r-001", ..., "r-127")
-RECORDING_CHANNELS = [f"r-{str(i).zfill(3)}" for i in range(128)]
+RECORDING_CHANNELS = [f"r-{i:03d}" for i in range(128)]
 
 # Amplitude range in microamps
 AMPLITUDE_RANGE = (0, 200)
@@ -26,11 +30,23 @@ MAX_ITERATIONS = 20
 # Target recording channel to maximize signal on (example: channel 30)
 TARGET_CHANNEL_INDEX = 30
 
+# TI beat frequency the recording is scored on (difference of the two carriers)
+BEAT_FREQUENCY_HZ = 50
+
+# Number of most recent samples the modulation index is computed over (1 s at 30 kHz)
+MI_WINDOW_SAMPLES = 30000
+
 # ----------------------------------------------------------------------
 # Data Acquisition
 # ----------------------------------------------------------------------
 
-def get_recording_data():
+# Output buffer filled in place by the get_recording_data_* functions on every iteration
+_REC_BUF = np.empty(len(RECORDING_CHANNELS), dtype=np.float64)
+
+# Random source for the mock recording
+_RNG = np.random.default_rng()
+
+def get_recording_data_rhs():
     """
     Acquire and process data from (up to) 128 recording channels
     of an Intan .rhs file.
@@ -38,61 +54,86 @@ def get_recording_data():
     Returns
     -------
     np.ndarray
-        A 1D numpy array of length 128 representing some processed 
-        measurement on each recording channel. In this example, we 
-        simply take the 'last sample' from each channel as a placeholder.
+        A 1D numpy array of length 128 holding the modulation index of
+        each recording channel at BEAT_FREQUENCY_HZ, computed over the last
+        MI_WINDOW_SAMPLES of the recording.
+        The same array is reused (and overwritten) on every call, so copy
+        it if you need to keep a previous iteration's values.
     """
-    # 1) NEED TO CHANGE THIS SO THAT THE RECORDING FUNCTION WE CAN SPECIFY THE OUTPUT
-    # MUST RETURN ONLY THE 50HZ AMPLITUDE
-    # THE NUMBER OF CHANNELS IS HARDCODED, IT SHOULD LOOK AT RECORDING_CHANNELS
+    from utils.read_data import read_intan_rhs_tail
+    from utils.metrics import modulation_index
+
     file_path = r"C:\Users\eddyt\Documents\Intan recordings\testing\testing2_250102_174724\testing2_250102_174724.rhs"
 
-    # 2) Use the utility function to read the file and extract amplifier data.
-    data, header = read_intan_rhs_file(file_path)
-    amplifier_data = data['amplifier_data']  # shape: (num_channels, total_samples)
-
-    # 3) Perform any further signal processing as desired.
-    #    For now, we just grab the last sample from the first 128 channels.
-    num_channels_in_file = amplifier_data.shape[0]
-    if num_channels_in_file >= 128:
-        # Example: last sample from each channel
-        recording_data = amplifier_data[:128, -1]
-    else:
-        # Fallback if fewer than 128 channels exist in the file
-        # (Or handle differently if your system always has at least 128)
-        dummy_fill = 128 - num_channels_in_file
-        recording_data = np.concatenate([
-            amplifier_data[:, -1],  # actual channels
-            np.zeros(dummy_fill)    # zero pad
-        ])
-
-    # Return our 1D array of length 128
-    return recording_data
+    # 1) Read just the most recent window of amplifier data; the rest of the
+    #    (potentially very large) recording is never touched.
+    amplifier_data, header = read_intan_rhs_tail(file_path, num_samples=MI_WINDOW_SAMPLES)
+
+    # 2) Score each channel by how strongly it follows the TI beat. The index
+    #    is scale-free, so the raw ADC counts need no conversion to microvolts.
+    mi = modulation_index(amplifier_data.astype(np.float64), BEAT_FREQUENCY_HZ,
+                          header['sample_rate'])
+
+    num_channels = min(mi.shape[0], _REC_BUF.shape[0])
+    _REC_BUF[:num_channels] = mi[:num_channels]
+
+    # Zero pad if the file has fewer channels than RECORDING_CHANNELS
+    _REC_BUF[num_channels:] = 0
+
+    return _REC_BUF
+
+def get_recording_data_mock():
+    """
+    Stand-in for get_recording_data_rhs with uniform random values, for dry
+    runs of the optimisation loop without a recording. Like the real version,
+    the returned array is reused on every call.
+    """
+    _RNG.random(out=_REC_BUF)
+    return _REC_BUF
 
 # ----------------------------------------------------------------------
-# Main Optimization Script
+# Optimization Loop
 # ----------------------------------------------------------------------
 
-if __name__ == "__main__":
-    # Initialize the Bayesian Optimization model
-    model = BOModel(ti_channels=TI_CHANNELS, amplitude_range=AMPLITUDE_RANGE)
-
-    for iteration in range(MAX_ITERATIONS):
-        print(f"Iteration {iteration + 1}/{MAX_ITERATIONS}")
-
-        # Get suggested parameters
-        action = model.suggest_parameters()
-        channel_a = action["channel_a"]
-        channel_b = action["channel_b"]
-        return_channel_a = action["return_channel_a"]
-        return_channel_b = action["return_channel_b"]
-        amplitude_a = action["amplitude_a"]
-        amplitude_b = action["amplitude_b"]
-
-        print(f"Selected parameters: "
-              f"channel_a={channel_a}, channel_b={channel_b}, "
-              f"return_channel_a={return_channel_a}, return_channel_b={return_channel_b}, "
-              f"amplitude_a={amplitude_a}, amplitude_b={amplitude_b}")
+def run_optimization(recording_fn, iterations=MAX_ITERATIONS, model=None):
+    """
+    Run the closed stimulation/recording optimisation loop.
+
+    Parameters
+    ----------
+    recording_fn : callable
+        Returns the per-channel recording measurement (length
+        len(RECORDING_CHANNELS)) after each stimulation, e.g.
+        get_recording_data_rhs or get_recording_data_mock.
+    iterations : int
+        Number of stimulate/measure/update rounds.
+    model : optional
+        Model with suggest_parameters/update/best_result. Defaults to a
+        BOModel over TI_CHANNELS and AMPLITUDE_RANGE.
+
+    Returns
+    -------
+    tuple
+        (best_result_value, best_params) from the model.
+    """
+    from utils.TI import run_ti_dipole_stimulation
+
+    if model is None:
+        # Initialize the Bayesian Optimization model
+        from models.bo_model import BOModel
+        model = BOModel(ti_channels=TI_CHANNELS, amplitude_range=AMPLITUDE_RANGE)
+
+    # The model update and the next suggestion run in a background thread while the
+    # current stimulation takes effect, so they are hidden behind LOOP_INTERVAL. The
+    # cost is one iteration of lag: each suggestion is made before the result of the
+    # stimulation running at the time is known.
+    action = model.suggest_parameters()
+    previous = None
+
+    for iteration in range(iterations):
+        (channel_a, channel_b,
+         return_channel_a, return_channel_b,
+         amplitude_a, amplitude_b) = action
 
         # Run stimulation with both source and return channels
         run_ti_dipole_stimulation(
@@ -104,23 +145,60 @@ if __name__ == "__main__":
             amplitude_b
         )
 
+        # Update the model with the previous result and get the next parameters
+        # (none needed after the last iteration) while we wait
+        planned = {}
+        def plan_next(previous=previous, suggest=iteration + 1 < iterations):
+            # Errors are handed back to the loop, which re-raises them once the
+            # worker has been joined
+            try:
+                if previous is not None:
+                    model.update(*previous)
+                if suggest:
+                    planned["action"] = model.suggest_parameters()
+            except BaseException as e:
+                planned["error"] = e
+        worker = threading.Thread(target=plan_next)
+        worker.start()
+
         # Wait for stimulation to take effect
         time.sleep(LOOP_INTERVAL)
 
         # Acquire recording data
-        recording_data = get_recording_data()
+        recording_data = recording_fn()
 
-        # Compute a result metric for the optimizer
-        result = (recording_data[TARGET_CHANNEL_INDEX]
-                  - 0.1 * np.sum(np.delete(recording_data, TARGET_CHANNEL_INDEX)))
+        # Compute a result metric for the optimizer: target channel minus 0.1x
+        # every other channel, written as one sum so no copy of the array is made
+        result = (1.1 * recording_data[TARGET_CHANNEL_INDEX]
+                  - 0.1 * recording_data.sum())
 
-        print(f"Result for current configuration: {result}")
+        logger.info("iter=%d/%d ch_a=%s ch_b=%s ret_a=%s ret_b=%s amp_a=%s amp_b=%s result=%.4f",
+                    iteration + 1, iterations, channel_a, channel_b, return_channel_a,
+                    return_channel_b, amplitude_a, amplitude_b, result)
 
-        # Update the Bayesian Optimization model with the new result
-        model.update(action, result)
+        worker.join()
+        if "error" in planned:
+            raise planned["error"]
+        previous = (action, result)
+        action = planned.get("action")
+
+    # The last result hasn't been given to the model yet
+    if previous is not None:
+        model.update(*previous)
 
     # After loop, get the best result found
-    best_result_value, best_params = model.best_result()
+    return model.best_result()
+
+# ----------------------------------------------------------------------
+# Main Optimization Script
+# ----------------------------------------------------------------------
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    # Importing utils.metrics compiles the modulation index kernel, so do it now
+    # rather than in the middle of the first iteration
+    import utils.metrics
+    best_result_value, best_params = run_optimization(get_recording_data_rhs)
     print("Optimization complete.")
     print(f"Best parameters: {best_params}")
     print(f"Best result value: {best_result_value}")
@@ -15,98 +15,213 @@ Gradient-free optimization algorithms (e.g., Nelder-Mead, CMA-ES): Could work bu
 Grid or Random Search: Very inefficient. You have a large discrete space (12 channels for channel_a, 11 possible distinct channels for channel_b, and a range of amplitudes).
 '''
 
-from skopt import Optimizer
-from skopt.space import Categorical, Integer
+from collections import namedtuple
+
 import numpy as np
 
-class BOModel:
-    def __init__(self, ti_channels, amplitude_range=(0, 200)):
+# One set of stimulation parameters, in the same order as the search space
+Action = namedtuple('Action', 'channel_a channel_b return_channel_a return_channel_b '
+                              'amplitude_a amplitude_b')
+
+# Parallelism handed to skopt (-1 = one per CPU core). What it parallelises depends on
+# the surrogate: with "GP", the acquisition function is optimised by L-BFGS, and its
+# restarts run in parallel joblib workers; with "RF" (and the other tree estimators)
+# the acquisition function is only sampled, and N_JOBS becomes the forest's n_jobs,
+# i.e. threads for fitting and predicting.
+N_JOBS = -1
+
+# skopt (and the scipy modules it pulls in) is slow to import, so it's imported in
+# the model constructors rather than when this module is loaded
+
+class _BaseBOModel:
+    """
+    Search space, suggestions and result bookkeeping shared by BOModel and
+    TVBOModel; subclasses decide what the optimizer is told in update().
+    """
+    def __init__(self, ti_channels, amplitude_range=(0, 200), batch_size=1,
+                 base_estimator="GP", acq_func="gp_hedge"):
+        from skopt.space import Categorical, Integer, Real
+
         # Define the parameter space:
         #   1) channel_a: categorical
-        #   2) channel_b: categorical
-        #   3) return_channel_a: categorical
-        #   4) return_channel_b: categorical
-        #   5) amplitude_a: integer
-        #   6) amplitude_b: integer
+        #   2) channel_b_offset: integer, which of the remaining channels is channel_b
+        #   3) return_channel_a_offset: integer, likewise for return_channel_a
+        #   4) return_channel_b_offset: integer, likewise for return_channel_b
+        #   5) amplitude_a: real, rounded to whole microamps when suggested
+        #   6) amplitude_b: real, likewise
+        # Encoding channels b, return a and return b as offsets into the channels not
+        # yet used means every point in the space has four distinct channels.
         self.ti_channels = ti_channels
         self.amplitude_range = amplitude_range
+        self._chan_to_idx = {c: i for i, c in enumerate(ti_channels)}
 
+        n = len(ti_channels)
         self.space = [
             Categorical(ti_channels, name='channel_a'),
-            Categorical(ti_channels, name='channel_b'),
-            Categorical(ti_channels, name='return_channel_a'),
-            Categorical(ti_channels, name='return_channel_b'),
-            Integer(amplitude_range[0], amplitude_range[1], name='amplitude_a'),
-            Integer(amplitude_range[0], amplitude_range[1], name='amplitude_b')
+            Integer(0, n - 2, name='channel_b_offset'),
+            Integer(0, n - 3, name='return_channel_a_offset'),
+            Integer(0, n - 4, name='return_channel_b_offset'),
+            Real(amplitude_range[0], amplitude_range[1], name='amplitude_a'),
+            Real(amplitude_range[0], amplitude_range[1], name='amplitude_b')
         ]
 
-        # Create a Bayesian optimization object
-        self.optimizer = Optimizer(dimensions=self.space, random_state=0)
+        # Create a Bayesian optimization object. The random state lives here so it
+        # carries on if a subclass rebuilds the optimizer
+        self.base_estimator = base_estimator
+        self.acq_func = acq_func
+        self._random_state = np.random.RandomState(0)
+        self.optimizer = self._new_optimizer()
 
-        # Keep track of (params, results)
+        # Keep track of (params, results). Results go in a preallocated array that
+        # doubles when full, and the best one is tracked as results arrive.
         self.params_history = []
-        self.results_history = []
+        self._results = np.empty(64)
+        self._n = 0
+        self._best_idx = -1
+        self._best_val = -np.inf
+
+        # With batch_size > 1, suggestions come from one constant-liar ask per batch
+        # and results are told to the optimizer (one GP fit) a batch at a time
+        self.batch_size = batch_size
+        self._pending = []
+        self._untold_X = []
+        self._untold_y = []
+
+    def _new_optimizer(self):
+        from skopt import Optimizer
+        # Only a GP gets L-BFGS acquisition optimisation, the one place the
+        # acq_optimizer_kwargs n_jobs is used
+        acq_optimizer_kwargs = {"n_jobs": N_JOBS} if self.base_estimator == "GP" else None
+        return Optimizer(dimensions=self.space, base_estimator=self.base_estimator,
+                         acq_func=self.acq_func, random_state=self._random_state,
+                         n_jobs=N_JOBS, acq_optimizer_kwargs=acq_optimizer_kwargs)
+
+    def _remaining_channels(self, channel_a):
+        """Channels other than channel_a, in order starting from the one after it."""
+        n = len(self.ti_channels)
+        start = self._chan_to_idx[channel_a] + 1
+        return [self.ti_channels[(start + k) % n] for k in range(n - 1)]
+
+    def _decode(self, point):
+        """Map a point in the offset-encoded space to four distinct channels."""
+        channel_a, offset_b, offset_ra, offset_rb, amplitude_a, amplitude_b = point
+        remaining = self._remaining_channels(channel_a)
+        channel_b = remaining.pop(offset_b)
+        return_channel_a = remaining.pop(offset_ra)
+        return_channel_b = remaining.pop(offset_rb)
+        # Amplitudes are searched as reals and applied in whole microamps; the
+        # rounded values are what update() reports back to the optimizer
+        return [channel_a, channel_b, return_channel_a, return_channel_b,
+                int(round(amplitude_a)), int(round(amplitude_b))]
+
+    def _encode(self, p):
+        """Inverse of _decode: channel names back to offsets."""
+        channel_a, channel_b, return_channel_a, return_channel_b, amplitude_a, amplitude_b = p
+        remaining = self._remaining_channels(channel_a)
+        offsets = []
+        for channel in (channel_b, return_channel_a, return_channel_b):
+            offsets.append(remaining.index(channel))
+            remaining.remove(channel)
+        return [channel_a, *offsets, amplitude_a, amplitude_b]
 
     def suggest_parameters(self):
         """
         Suggest new parameters to try based on past results.
-        Ensures channel_a, channel_b, return_channel_a, return_channel_b 
-        are all distinct.
+        channel_a, channel_b, return_channel_a, return_channel_b are always
+        distinct, so a single ask() is enough.
         """
-        while True:
-            # Suggest a new set of parameters from the optimizer
-            suggestion = self.optimizer.ask()
-            (channel_a, channel_b,
-             return_channel_a, return_channel_b,
-             amplitude_a, amplitude_b) = suggestion
-
-            # Check uniqueness of all channels, we do not want to share any channels
-            all_channels = {channel_a, channel_b, return_channel_a, return_channel_b}
-            if len(all_channels) == 4:
-                # We have four distinct channel names; break out of loop
-                break
-            # Otherwise, keep asking until we get a set of distinct channels
-
-        return {
-            "channel_a": channel_a,
-            "channel_b": channel_b,
-            "return_channel_a": return_channel_a,
-            "return_channel_b": return_channel_b,
-            "amplitude_a": amplitude_a,
-            "amplitude_b": amplitude_b
-        }
+        if self.batch_size > 1 and not self._pending:
+            self.suggest_batch(self.batch_size)
+        if self._pending:
+            return self._pending.pop(0)
 
-    def update(self, params, result):
+        self._tell_untold()
+        (channel_a, channel_b,
+         return_channel_a, return_channel_b,
+         amplitude_a, amplitude_b) = self._decode(self.optimizer.ask())
+
+        return Action(channel_a, channel_b, return_channel_a, return_channel_b,
+                      amplitude_a, amplitude_b)
+
+    def suggest_batch(self, q=4):
         """
-        Update the optimizer with the result from a given set of parameters.
-        'result' should be a scalar score (the value you want to maximize).
+        Ask the optimizer for q parameter sets at once, using the constant liar
+        strategy so they are spread out rather than identical. They are handed
+        out by the next q calls to suggest_parameters, and returned here too.
         """
-        # Convert to the parameter order used in suggest_parameters
-        p = [
-            params["channel_a"],
-            params["channel_b"],
-            params["return_channel_a"],
-            params["return_channel_b"],
-            params["amplitude_a"],
-            params["amplitude_b"]
-        ]
-        self.params_history.append(p)
-        self.results_history.append(result)
+        self._tell_untold()
 
-        # The optimizer expects a MINIMIZATION problem. We want to maximize,
-        # so we pass -result.
-        self.optimizer.tell(p, -result)
+        # Same as optimizer.ask(n_points=q, strategy="cl_min"), except that skopt
+        # also lies about (and refits on) the last point, which nothing then uses.
+        # Each lie is the best value so far, steering the next point elsewhere.
+        opt = self.optimizer.copy(
+            random_state=self.optimizer.rng.randint(0, np.iinfo(np.int32).max))
+        self._pending = []
+        for i in range(q):
+            x = opt.ask()
+            self._pending.append(Action(*self._decode(x)))
+            if i < q - 1:
+                opt.tell(x, min(opt.yi) if opt.yi else 0.0)
+        return list(self._pending)
+
+    def _tell_untold(self):
+        """Give the optimizer every result it hasn't seen yet, in one tell (one fit)."""
+        if self._untold_X:
+            self.optimizer.tell(self._untold_X, self._untold_y)
+            self._untold_X = []
+            self._untold_y = []
+
+    def _record(self, params, result):
+        """Add a result to the history and the running best; returns the params as a list."""
+        # Action fields are already in the parameter order used by the optimizer
+        p = list(params)
+        self.params_history.append(p)
+        if self._n == self._results.shape[0]:
+            self._results = np.resize(self._results, 2 * self._n)
+        self._results[self._n] = result
+        if result > self._best_val:
+            self._best_idx = self._n
+            self._best_val = result
+        self._n += 1
+        return p
 
     def best_result(self):
         """
         Return the best result found so far and corresponding parameters.
         """
-        if not self.results_history:
+        if self._best_idx < 0:
             return None, None
-        best_idx = np.argmax(self.results_history)
-        return self.results_history[best_idx], self.params_history[best_idx]
+        return self._best_val, self.params_history[self._best_idx]
 
-class TVBOModel:
+    @property
+    def results_history(self):
+        """Results so far, in the order they were reported (a view, not a copy)."""
+        return self._results[:self._n]
+
+class BOModel(_BaseBOModel):
+    def __init__(self, ti_channels, amplitude_range=(0, 200), batch_size=1,
+                 base_estimator="RF"):
+        # The surrogate defaults to a random forest: the space is mostly categorical,
+        # which forests handle well, and refitting one is far cheaper than a GP's
+        # O(n^3) refit ("GP" restores that)
+        super().__init__(ti_channels, amplitude_range, batch_size=batch_size,
+                         base_estimator=base_estimator, acq_func="LCB")
+
+    def update(self, params, result):
+        """
+        Update the optimizer with the result from a given set of parameters.
+        'result' should be a scalar score (the value you want to maximize).
+        """
+        p = self._record(params, result)
+
+        # The optimizer expects a MINIMIZATION problem. We want to maximize,
+        # so we pass -result. Results are held back until a whole batch is in.
+        self._untold_X.append(self._encode(p))
+        self._untold_y.append(-result)
+        if len(self._untold_X) >= self.batch_size:
+            self._tell_untold()
+
+class TVBOModel(_BaseBOModel):
     def __init__(self, ti_channels, amplitude_range=(0, 200), time_decay=0.9):
         """
         Initialize a Time-Varying Bayesian Optimization model.
@@ -116,88 +231,38 @@ class TVBOModel:
         - amplitude_range: Tuple (min, max) for amplitude values.
         - time_decay: Weight applied to past observations, with recent data having more influence.
         """
-        self.ti_channels = ti_channels
-        self.amplitude_range = amplitude_range
+        super().__init__(ti_channels, amplitude_range)
         self.time_decay = time_decay  # Determines how much old data influences the model.
 
-        self.space = [
-            Categorical(ti_channels, name='channel_a'),
-            Categorical(ti_channels, name='channel_b'),
-            Categorical(ti_channels, name='return_channel_a'),
-            Categorical(ti_channels, name='return_channel_b'),
-            Integer(amplitude_range[0], amplitude_range[1], name='amplitude_a'),
-            Integer(amplitude_range[0], amplitude_range[1], name='amplitude_b')
-        ]
-
-        # Create a Bayesian optimization object
-        self.optimizer = Optimizer(dimensions=self.space, random_state=0)
-
-        # Keep track of (params, results, timestamps)
-        self.params_history = []
-        self.results_history = []
+        # Keep track of encoded params and timestamps as well
+        self._encoded_history = []
         self.time_stamps = []
 
-    def suggest_parameters(self):
-        """
-        Suggest new parameters to try based on past results.
-        Ensures channel_a, channel_b, return_channel_a, return_channel_b 
-        are all distinct.
-        """
-        while True:
-            suggestion = self.optimizer.ask()
-            (channel_a, channel_b,
-             return_channel_a, return_channel_b,
-             amplitude_a, amplitude_b) = suggestion
-
-            # Ensure all channels are distinct
-            all_channels = {channel_a, channel_b, return_channel_a, return_channel_b}
-            if len(all_channels) == 4:
-                break
-
-        return {
-            "channel_a": channel_a,
-            "channel_b": channel_b,
-            "return_channel_a": return_channel_a,
-            "return_channel_b": return_channel_b,
-            "amplitude_a": amplitude_a,
-            "amplitude_b": amplitude_b
-        }
+        # Decayed (negated) results, kept up to date incrementally: each update
+        # scales the existing values by time_decay once and appends the new one
+        self._decayed = np.empty(64)
 
     def update(self, params, result):
         """
         Update the optimizer with the result from a given set of parameters.
         Applies a time decay to older results to account for temporal changes.
         """
-        # Convert to parameter order used in suggest_parameters
-        p = [
-            params["channel_a"],
-            params["channel_b"],
-            params["return_channel_a"],
-            params["return_channel_b"],
-            params["amplitude_a"],
-            params["amplitude_b"]
-        ]
-        
+        p = self._record(params, result)
+
         current_time = len(self.time_stamps)  # Simulate a time index (or use a real timestamp if available)
-        self.params_history.append(p)
-        self.results_history.append(result)
+        self._encoded_history.append(self._encode(p))
         self.time_stamps.append(current_time)
 
-        # Apply time decay to past results
-        adjusted_results = [
-            -res * (self.time_decay ** (current_time - t)) 
-            for t, res in enumerate(self.results_history)
-        ]
+        # Apply one more step of time decay to past results, then add the new one
+        decayed = self._decayed
+        if current_time == decayed.shape[0]:
+            decayed = self._decayed = np.resize(decayed, 2 * current_time)
+        np.multiply(decayed[:current_time], self.time_decay, out=decayed[:current_time])
+        decayed[current_time] = -result
+        adjusted_results = decayed[:current_time + 1]
 
-        # Update optimizer with decayed results
-        for param, adj_result in zip(self.params_history, adjusted_results):
-            self.optimizer.tell(param, adj_result)
-
-    def best_result(self):
-        """
-        Return the best result found so far and corresponding parameters.
-        """
-        if not self.results_history:
-            return None, None
-        best_idx = np.argmax(self.results_history)
-        return self.results_history[best_idx], self.params_history[best_idx]
\ No newline at end of file
+        # Every decayed value changes on each update, so give a fresh optimizer the
+        # whole decayed history in one tell (a single GP fit) rather than telling
+        # the existing one every point again
+        self.optimizer = self._new_optimizer()
+        self.optimizer.tell(self._encoded_history, adjusted_results.tolist())
@@ -0,0 +1,211 @@
+'''
+Gaussian process Bayesian optimisation with an incrementally updated Cholesky factor.
+
+skopt's Optimizer (as used by BOModel with base_estimator="GP") refits its GP from
+scratch on every tell(), which means rebuilding and factorising the full n x n kernel
+matrix: O(n^3) per iteration.
+Here the kernel hyperparameters are fixed, so the kernel matrix only ever grows by one
+row/column per observation, and its Cholesky factor can be extended in place:
+
+    L_new = [[L,   0],
+             [w^T, d]]    with  w = L^-1 k_new,  d = sqrt(k** - w^T w)
+
+which is a single O(n^2) triangular solve per update. Refitting the targets (they are
+standardised) also only needs triangular solves against the same factor.
+
+The acquisition function (expected improvement) is evaluated on a fixed grid of the
+design space instead of being optimised per suggestion: every ordered assignment of
+four distinct channels, each paired with a few scrambled Sobol amplitude pairs, so any
+channel configuration can be suggested. Because the grid never changes,
+L^-1 k(X, grid) is cached and extended by one row per update as well, so the
+posterior over the whole grid costs one O(M n) product per suggestion.
+
+GPBOModel has the same interface as BOModel, so it can be passed to run_optimization
+in TI_dipole_model.py as the model.
+'''
+
+from itertools import permutations
+
+import numpy as np
+from scipy.linalg import solve_triangular
+from scipy.stats import norm, qmc
+
+from models.bo_model import Action
+
+class GPBOModel:
+    def __init__(self, ti_channels, amplitude_range=(0, 200), n_initial_points=10,
+                 amplitude_points_log2=2, length_scale=0.2, channel_decay=0.5, noise=1e-3,
+                 random_state=0):
+        """
+        Parameters:
+        - ti_channels: List of available channels for stimulation.
+        - amplitude_range: Tuple (min, max) for amplitude values.
+        - n_initial_points: Number of random suggestions made before the GP is used.
+        - amplitude_points_log2: Each channel assignment appears in the acquisition
+          grid with 2**amplitude_points_log2 amplitude pairs. The grid covers all
+          n*(n-1)*(n-2)*(n-3) assignments of n channels (11880 for 12), so its size,
+          and the memory and time per update, grow as n^4 times this; after the
+          initial random points, amplitudes are only ever suggested from these pairs.
+        - length_scale: Amplitude length scale, as a fraction of the amplitude range.
+        - channel_decay: Kernel decay per channel slot that differs between two points.
+        - noise: Observation noise variance (relative to the standardised results).
+        - random_state: Seed for the random suggestions and the grid scrambling.
+        """
+        self.ti_channels = ti_channels
+        self.amplitude_range = amplitude_range
+        self.n_initial_points = n_initial_points
+        self.channel_decay = channel_decay
+        self.noise = noise
+
+        self._chan_to_idx = {c: i for i, c in enumerate(ti_channels)}
+        self._amp_scale = (amplitude_range[1] - amplitude_range[0]) * length_scale
+        self._rng = np.random.default_rng(random_state)
+
+        # Lower Cholesky factor of (K + noise * I), grown geometrically as points arrive
+        self._L = np.zeros((64, 64))
+        self._n = 0
+
+        # Fixed acquisition grid, the cached rows of L^-1 k(X, grid) and the posterior
+        # variance on the grid, which each update only ever lowers
+        self._grid_ch, self._grid_amp = self._acquisition_grid(amplitude_points_log2, random_state)
+        self._V = np.zeros((64, self._grid_ch.shape[0]))
+        self._grid_var = np.ones(self._grid_ch.shape[0])
+
+        # Keep track of (params, results). Params are stored column-wise in one
+        # contiguous int32 array (four channel indices, then the two amplitudes)
+        # that the kernel can slice directly; it grows alongside _L.
+        self._X = np.empty((64, 6), dtype=np.int32)
+        self.results_history = []
+
+    @property
+    def params_history(self):
+        """Params so far as [channel_a, channel_b, return_a, return_b, amp_a, amp_b] lists."""
+        return [self._decode(row) for row in self._X[:self._n]]
+
+    def _decode(self, row):
+        return [self.ti_channels[i] for i in row[:4]] + [int(row[4]), int(row[5])]
+
+    def _kernel(self, ch1, amp1, ch2, amp2):
+        """
+        Product kernel: exponential decay in the number of channel slots that differ,
+        times a squared-exponential over the two amplitudes. k(x, x) = 1.
+        """
+        mismatches = (ch1[:, None, :] != ch2[None, :, :]).sum(axis=-1)
+        d = (amp1[:, None, :] - amp2[None, :, :]) / self._amp_scale
+        return np.exp(-self.channel_decay * mismatches - 0.5 * (d * d).sum(axis=-1))
+
+    def _acquisition_grid(self, amplitude_points_log2, seed):
+        """
+        Every ordered assignment of four distinct channels, each with the same
+        scrambled Sobol set of 2**amplitude_points_log2 amplitude pairs shifted by
+        a random offset per assignment (modulo the amplitude range), so the pairs
+        are spread evenly within each assignment and differ between assignments.
+        """
+        n_channels = len(self.ti_channels)
+        channels = np.array(list(permutations(range(n_channels), 4)), dtype=np.int32)
+        n_points = 2 ** amplitude_points_log2
+
+        u = qmc.Sobol(d=2, seed=seed).random_base2(amplitude_points_log2)
+        shifts = np.random.default_rng(seed).random((channels.shape[0], 1, 2))
+        u = ((u[None, :, :] + shifts) % 1.0).reshape(-1, 2)
+
+        low, high = self.amplitude_range
+        amplitudes = low + np.floor(u * (high - low + 1))
+        return np.repeat(channels, n_points, axis=0), amplitudes
+
+    def _random_channels(self, count):
+        """Draw `count` rows of four distinct channel indices."""
+        return np.argsort(self._rng.random((count, len(self.ti_channels))), axis=1)[:, :4]
+
+    def _random_amplitudes(self, count):
+        low, high = self.amplitude_range
+        return self._rng.integers(low, high + 1, size=(count, 2))
+
+    def suggest_parameters(self):
+        """
+        Suggest new parameters to try based on past results.
+        channel_a, channel_b, return_channel_a, return_channel_b are always distinct,
+        as every candidate is drawn with four distinct channels.
+        """
+        if self._n < self.n_initial_points:
+            channels = self._random_channels(1)[0]
+            amplitudes = self._random_amplitudes(1)[0]
+        else:
+            best = np.argmax(self._expected_improvement())
+            channels, amplitudes = self._grid_ch[best], self._grid_amp[best]
+
+        channel_a, channel_b, return_channel_a, return_channel_b = (
+            self.ti_channels[i] for i in channels)
+        return Action(channel_a, channel_b, return_channel_a, return_channel_b,
+                      int(amplitudes[0]), int(amplitudes[1]))
+
+    def _expected_improvement(self, xi=0.01):
+        """Analytic EI (for maximisation) of each grid point under the current GP."""
+        n = self._n
+
+        # Standardise the results; they only enter the posterior mean, through
+        # beta = L^-1 y, so the mean on the grid is beta^T (L^-1 k(X, grid))
+        y = np.asarray(self.results_history, dtype=np.float64)
+        y_std = y.std() or 1.0
+        y = (y - y.mean()) / y_std
+        beta = solve_triangular(self._L[:n, :n], y, lower=True)
+        mu = beta @ self._V[:n]
+        sigma = np.sqrt(np.maximum(self._grid_var, 1e-12))
+
+        improvement = mu - y.max() - xi
+        z = improvement / sigma
+        return improvement * norm.cdf(z) + sigma * norm.pdf(z)
+
+    def update(self, params, result):
+        """
+        Update the model with the result from a given set of parameters.
+        'result' should be a scalar score (the value you want to maximize).
+        Extends the Cholesky factor by one row instead of refactorising.
+        """
+        # Encode in the column order used by _X
+        x = np.array([
+            self._chan_to_idx[params.channel_a],
+            self._chan_to_idx[params.channel_b],
+            self._chan_to_idx[params.return_channel_a],
+            self._chan_to_idx[params.return_channel_b],
+            params.amplitude_a,
+            params.amplitude_b
+        ], dtype=np.int32)[None, :]
+        new_ch, new_amp = x[:, :4], x[:, 4:]
+
+        n = self._n
+        if n:
+            k_new = self._kernel(new_ch, new_amp, self._X[:n, :4], self._X[:n, 4:])[0]
+            w = solve_triangular(self._L[:n, :n], k_new, lower=True)
+        else:
+            w = np.empty(0)
+        # Guard against round-off when the same point is observed twice
+        d = np.sqrt(max(1.0 + self.noise - w @ w, 1e-12))
+
+        if n == self._L.shape[0]:
+            grown = np.zeros((2 * n, 2 * n))
+            grown[:n, :n] = self._L
+            self._L = grown
+            self._V = np.resize(self._V, (2 * n, self._V.shape[1]))
+            self._X = np.resize(self._X, (2 * n, 6))
+        self._X[n] = x[0]
+        self._L[n, :n] = w
+        self._L[n, n] = d
+
+        # New row of L^-1 k(X, grid), from the same forward substitution step
+        k_grid = self._kernel(new_ch, new_amp, self._grid_ch, self._grid_amp)[0]
+        v = (k_grid - w @ self._V[:n]) / d
+        self._V[n] = v
+        self._grid_var -= v * v
+        self._n = n + 1
+
+        self.results_history.append(result)
+
+    def best_result(self):
+        """
+        Return the best result found so far and corresponding parameters.
+        """
+        if not self.results_history:
+            return None, None
+        best_idx = np.argmax(self.results_history)
+        return self.results_history[best_idx], self._decode(self._X[best_idx])
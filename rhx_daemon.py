@@ -0,0 +1,128 @@
+import os
+import re
+import socket
+import selectors
+from collections import deque
+
+from utils.TCP import RHX_TCPClient, COMMAND_SEPARATOR
+
+# ======================================================================
+# Configuration Parameters
+# ======================================================================
+HOST = "127.0.0.1"  # RHX command server
+PORT = 5000
+
+# Local endpoint the stimulation scripts connect to instead of RHX
+UNIX_SOCKET_PATH = "/tmp/rhx.sock"  # Used where Unix sockets are available
+LOCAL_PORT = 5001                   # Fallback local TCP port otherwise (e.g. Windows)
+
+# ======================================================================
+# Helper Functions
+# ======================================================================
+
+def create_listener():
+    # Prefer a Unix socket: no TCP handshake or loopback stack for each script
+    if hasattr(socket, "AF_UNIX"):
+        if os.path.exists(UNIX_SOCKET_PATH):
+            os.unlink(UNIX_SOCKET_PATH)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(UNIX_SOCKET_PATH)
+        print(f"Listening on {UNIX_SOCKET_PATH}")
+    else:
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # Allow an immediate restart of the daemon on the same port
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind(("127.0.0.1", LOCAL_PORT))
+        print(f"Listening on 127.0.0.1:{LOCAL_PORT}")
+    listener.listen()
+    return listener
+
+SEPARATOR = COMMAND_SEPARATOR.encode('utf-8')
+
+# RHX replies start with one of these; a chunk from RHX is split at each of them
+_REPLY_START = re.compile(rb"(?=Return:|Error:)")
+
+def complete_commands(buffer, data):
+    # Add data to a script's buffer and take off the commands that are complete
+    # (separator-terminated); a partial command stays in the buffer
+    buffer += data
+    end = buffer.rfind(SEPARATOR) + len(SEPARATOR)
+    complete = bytes(buffer[:end])
+    del buffer[:end]
+    return complete
+
+def relay(client, listener):
+    # Forward whole commands from local scripts to RHX, one script's block at a
+    # time so commands from different scripts are never interleaved mid-command.
+    # RHX answers 'get' commands in order, so each 'Return:' reply goes to the
+    # script whose 'get' is oldest; errors go to the script that sent last.
+    sel = selectors.DefaultSelector()
+    sel.register(listener, selectors.EVENT_READ)
+    sel.register(client.sock, selectors.EVENT_READ)
+    buffers = {}
+    pending_gets = deque()
+    last_sender = None
+    reply_to = None  # where the reply currently being received is going
+
+    while True:
+        for key, _ in sel.select():
+            sock = key.fileobj
+            if sock is listener:
+                conn, _ = listener.accept()
+                sel.register(conn, selectors.EVENT_READ)
+                buffers[conn] = bytearray()
+                print("Script connected.")
+            elif sock is client.sock:
+                data = client.sock.recv(4096)
+                if not data:
+                    print("RHX closed the connection.")
+                    return
+                for part in _REPLY_START.split(data):
+                    if not part:
+                        continue
+                    if part.startswith(b"Return:"):
+                        reply_to = pending_gets.popleft() if pending_gets else last_sender
+                    elif part.startswith(b"Error:"):
+                        reply_to = last_sender
+                    # Otherwise the part continues the previous reply
+                    if reply_to is not None:
+                        try:
+                            reply_to.sendall(part)
+                        except OSError:
+                            pass
+            else:
+                data = sock.recv(65536)
+                if not data:
+                    sel.unregister(sock)
+                    sock.close()
+                    # Its incomplete command is dropped; replies still owed to it
+                    # are discarded when they arrive
+                    del buffers[sock]
+                    if sock is last_sender:
+                        last_sender = None
+                    print("Script disconnected.")
+                    continue
+                block = complete_commands(buffers[sock], data)
+                if not block:
+                    continue
+                for command in block.split(SEPARATOR):
+                    if command.strip().lower().startswith(b"get "):
+                        pending_gets.append(sock)
+                client.sock.sendall(block)
+                last_sender = sock
+
+if __name__ == "__main__":
+    # One persistent connection to RHX, shared by every script run against the daemon
+    client = RHX_TCPClient(host=HOST, port=PORT)
+    listener = create_listener()
+
+    try:
+        if client.sock:
+            relay(client, listener)
+    except KeyboardInterrupt:
+        print("Process interrupted by user.")
+    finally:
+        listener.close()
+        if listener.family == getattr(socket, "AF_UNIX", None):
+            os.unlink(UNIX_SOCKET_PATH)
+        client.close()
@@ -1,39 +1,255 @@
+import select
 import socket
 import time
 import os
 import datetime
 
+# RHX splits incoming data on semicolons, so several commands can share one packet
+COMMAND_SEPARATOR = ";"
+_SEPARATOR_BYTES = COMMAND_SEPARATOR.encode('utf-8')
+
+# Commands sent on every stimulation, encoded once
+RUN = b"set runmode run"
+STOP = b"set runmode stop"
+
+# Kernel send buffer size, large enough to hold a full batched command block
+SEND_BUFFER_SIZE = 65536
+
+# Size of the write buffer that coalesces individual commands between flushes
+WRITE_BUFFER_SIZE = 65536
+
+# Initial size of the buffer send_commands assembles blocks in without sendmsg;
+# it grows (and stays grown) if a block doesn't fit
+BLOCK_BUFFER_SIZE = 16384
+
+# How long to wait for the server's reply to a 'get' command (seconds)
+RESPONSE_TIMEOUT = 1.0
+
+# Socket timeout once connected (seconds). The connect timeout only guards the
+# handshake; commands go out into the kernel buffer and normally never wait, so
+# by default sends block rather than inheriting the connect timeout.
+SEND_TIMEOUT = None
+
+# Upper bound on buffers handed to a single sendmsg (Linux IOV_MAX is 1024)
+_MAX_IOV = 512
+
+# recording() enables the same 128 amplifier channels every time, so the command
+# block is built and encoded once here
+_ENABLE_RECORDING_BLOB = b"".join(
+    f"set a-{i:03d}.recordingenabled true".encode('utf-8') + _SEPARATOR_BYTES
+    for i in range(128))
+
 class RHX_TCPClient:
-    def __init__(self, host='127.0.0.1', port=5000, timeout=2):
-        """Initialize TCP client and establish connection to the commands server."""
+    def __init__(self, host='127.0.0.1', port=5000, timeout=2, unix_path=None,
+                 send_timeout=SEND_TIMEOUT):
+        """
+        Initialize TCP client and establish connection to the commands server.
+        If unix_path is given, connect to a local rhx_daemon.py on that Unix
+        socket instead, sharing its already-open connection to RHX.
+        `timeout` applies to connecting; `send_timeout` replaces it afterwards.
+        """
         self.host = host
         self.port = port
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.unix_path = unix_path
+        self.send_timeout = send_timeout
+        family = socket.AF_UNIX if unix_path else socket.AF_INET
+        self.sock = socket.socket(family, socket.SOCK_STREAM)
+        if family == socket.AF_INET:
+            # Set before connecting so the buffer size is in place for the handshake.
+            # Commands are tiny; don't let Nagle hold them back waiting to coalesce
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SEND_BUFFER_SIZE)
+            # Long-lived connections (e.g. held by rhx_daemon.py) should notice a dead peer
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
         self.sock.settimeout(timeout)
+        self.writer = None
+        # Reused by send_commands when it has to build the block itself
+        self._send_buf = bytearray(BLOCK_BUFFER_SIZE)
         self.connect()
 
     def connect(self):
         """Connect to the RHX TCP server (commands server)."""
         try:
-            self.sock.connect((self.host, self.port))
-            print(f"Connected to RHX at {self.host}:{self.port}")
+            if self.unix_path:
+                self.sock.connect(self.unix_path)
+                print(f"Connected to RHX daemon at {self.unix_path}")
+            else:
+                self.sock.connect((self.host, self.port))
+                print(f"Connected to RHX at {self.host}:{self.port}")
+            self.sock.settimeout(self.send_timeout)
+            # Single commands are buffered here and go out together on flush()
+            self.writer = self.sock.makefile('wb', buffering=WRITE_BUFFER_SIZE)
         except Exception as e:
             print(f"Connection error: {e}")
             self.sock = None
 
-    def send_command(self, command, delay=0.01):
-        """Send a command without waiting for a response."""
+    def send_command(self, command, wait_response=False):
+        """
+        Queue a command in the write buffer. It reaches the server on the next
+        flush(), which send_commands(), read_response() and close() all do
+        first, so call flush() yourself before sleeping on the board.
+        The command may be str or pre-encoded bytes (e.g. RUN, STOP).
+        With wait_response=True the server's reply (e.g. to a 'get' command) is
+        returned, or None if nothing arrives within RESPONSE_TIMEOUT.
+        """
         if self.sock:
             try:
-                self.sock.sendall(command.encode('utf-8'))
+                if isinstance(command, bytes):
+                    self.writer.write(command)
+                    command = command.decode('utf-8')
+                else:
+                    self.writer.write(command.encode('utf-8'))
+                self.writer.write(_SEPARATOR_BYTES)
                 print(f"Sent: {command}")
-                time.sleep(delay)
+                if wait_response:
+                    return self.read_response()
             except Exception as e:
                 print(f"Error sending command: {e}")
 
+    def read_response(self, timeout=RESPONSE_TIMEOUT):
+        """Read one reply from the server, or return None if none arrives in time."""
+        if not self.sock:
+            return None
+        self.flush()
+        previous_timeout = self.sock.gettimeout()
+        self.sock.settimeout(timeout)
+        try:
+            return self.sock.recv(1024).decode('utf-8')
+        except socket.timeout:
+            return None
+        finally:
+            self.sock.settimeout(previous_timeout)
+
+    def drain_responses(self, timeout=0.1):
+        """
+        Return everything the server has sent back so far (e.g. errors for
+        rejected commands) as one string, waiting up to `timeout` for more to
+        arrive; timeout=0 only takes what is already there. Lets a block of
+        commands go out without a round trip each, with the replies checked
+        once afterwards.
+        """
+        if not self.sock:
+            return ""
+        self.flush()
+        chunks = []
+        previous_timeout = self.sock.gettimeout()
+        self.sock.settimeout(timeout)
+        try:
+            while True:
+                data = self.sock.recv(4096)
+                if not data:
+                    break
+                chunks.append(data)
+        except (socket.timeout, BlockingIOError):
+            pass
+        finally:
+            self.sock.settimeout(previous_timeout)
+        return b"".join(chunks).decode('utf-8')
+
+    def send_commands(self, commands, delay=0):
+        """
+        Send a block of commands in one write, optionally pausing `delay`
+        seconds afterwards. No pause is needed by default: the server works
+        through commands in order, and a 'get' command (send_command with
+        wait_response=True) waits for it to catch up where that matters.
+        Commands may be str or pre-encoded bytes.
+        """
+        if self.sock:
+            try:
+                # Anything queued by send_command must go out first
+                self.flush()
+                if hasattr(self.sock, "sendmsg"):
+                    # Keep each command as its own buffer for a vectored write
+                    block = []
+                    for c in commands:
+                        block.append(c if isinstance(c, bytes) else c.encode('utf-8'))
+                        block.append(_SEPARATOR_BYTES)
+                    self._send_parts(block)
+                    count = len(block) // 2
+                else:
+                    # No sendmsg (e.g. Windows): copy the block into the client's
+                    # reusable buffer and send the filled part of it
+                    buf = self._send_buf
+                    off = 0
+                    count = 0
+                    for c in commands:
+                        data = c if isinstance(c, bytes) else c.encode('utf-8')
+                        end = off + len(data) + len(_SEPARATOR_BYTES)
+                        if end > len(buf):
+                            buf.extend(bytes(max(end, 2 * len(buf)) - len(buf)))
+                        buf[off:end - len(_SEPARATOR_BYTES)] = data
+                        buf[end - len(_SEPARATOR_BYTES):end] = _SEPARATOR_BYTES
+                        off = end
+                        count += 1
+                    with memoryview(buf) as view:
+                        self.sock.sendall(view[:off])
+                print(f"Sent {count} commands")
+                time.sleep(delay)
+            except Exception as e:
+                print(f"Error sending commands: {e}")
+
+    def _send_parts(self, parts):
+        """
+        Write a list of byte strings with vectored sendmsg calls, so the block
+        never has to be joined into a single buffer.
+        """
+        i = 0
+        while i < len(parts):
+            sent = self.sock.sendmsg(parts[i:i + _MAX_IOV])
+            # Skip past whatever the kernel accepted; resume mid-buffer on a partial write
+            while i < len(parts) and sent >= len(parts[i]):
+                sent -= len(parts[i])
+                i += 1
+            if sent:
+                parts[i] = memoryview(parts[i])[sent:]
+
+    def wait(self, duration, poll_interval=0.25):
+        """
+        Wait `duration` seconds while watching the socket, printing anything the
+        server sends (e.g. errors) as it arrives instead of leaving it to pile up
+        in the receive buffer. Wakes at least every poll_interval seconds, so
+        Ctrl-C is handled promptly.
+        """
+        if not self.sock:
+            # Nothing to watch; still wait, so callers' timing is unchanged
+            time.sleep(duration)
+            return
+        deadline = time.monotonic() + duration
+        while (remaining := deadline - time.monotonic()) > 0:
+            readable, _, _ = select.select([self.sock], [], [], min(remaining, poll_interval))
+            if readable:
+                data = self.sock.recv(4096)
+                if not data:
+                    print("Server closed the connection.")
+                    break
+                print(f"Server: {data.decode('utf-8', errors='replace')}")
+
+    def _write_raw(self, data):
+        """
+        Queue already separated, encoded commands in the write buffer as they
+        are. Returns False (sending nothing) if there is no connection.
+        """
+        if self.sock and self.writer:
+            try:
+                self.writer.write(data)
+                return True
+            except Exception as e:
+                print(f"Error sending commands: {e}")
+        return False
+
+    def flush(self):
+        """Send any commands still waiting in the write buffer."""
+        if self.writer:
+            try:
+                self.writer.flush()
+            except Exception as e:
+                print(f"Error sending commands: {e}")
+
     def close(self):
         """Close the connection."""
         if self.sock:
+            self.flush()
+            self.writer.close()
             self.sock.close()
             print("Connection closed.")
 
@@ -52,9 +268,11 @@ class RHX_TCPClient:
 
         import datetime
 
-        # 1. Stop board if it's currently running (so we can safely change file params)
-        self.send_command("set runmode stop")
-        time.sleep(0.2)
+        # 1. Stop board if it's currently running (so we can safely change file params).
+        #    RHX handles commands in order and answers 'get' commands, so waiting for
+        #    the runmode reply confirms the stop has been processed.
+        self.send_command(STOP)
+        self.send_command("get runmode", wait_response=True)
 
         # Generate a time-stamped subdirectory and filename
         now = datetime.datetime.now()
@@ -66,48 +284,48 @@ class RHX_TCPClient:
 
         # 2. Clear all data outputs (good practice, especially if channels were previously enabled)
         self.send_command("execute clearalldataoutputs")
-        time.sleep(0.2)
 
         # Set the path where Intan will save files
         cmd_path = f"set filename.path {data_dir}"
         self.send_command(cmd_path)
-        time.sleep(0.2)
 
         # Set a base filename (without extension). Intan will append the timestamp internally as well.
         base_filename = f"recording_{date_str}"
         cmd_basefile = f"set filename.basefilename {base_filename}"
         self.send_command(cmd_basefile)
-        time.sleep(0.2)
 
         # Tell Intan to automatically create a subfolder named with date/time (if you want)
         # If True, Intan will create an extra subfolder, so your final path might be nested further.
         self.send_command("set createnewdirectory true")
-        time.sleep(0.2)
 
         # Choose to save everything into a single .rhs file
         self.send_command("set fileformat Traditional")
-        time.sleep(0.2)
 
         # Optionally enable saving wideband amplifier waveforms
         self.send_command("set savewidebandamplifierwaveforms true")
-        time.sleep(0.2)
 
         # 3. Enable recording for all amplifier channels a-000 through a-127
         #    Adjust if your system has a different number of channels or naming scheme.
-        for i in range(128):
-            channel_name = f"a-{i:03d}"
-            self.send_command(f"set {channel_name}.recordingenabled true")
-        time.sleep(0.2)
+        #    All 128 are queued as one prebuilt block rather than command by command.
+        if self._write_raw(_ENABLE_RECORDING_BLOB):
+            print("Sent 128 recordingenabled commands")
+
+        # Everything above goes out in one write; the reply to this 'get' means the
+        # server has applied all of it, so recording can start straight away
+        self.send_command("get runmode", wait_response=True)
 
         # 4. Start recording (instead of just 'run' mode, we use 'record' to produce .rhs)
         self.send_command("set runmode record")
         print("Recording started...")
         
-        # 5. Wait for the specified record_time (in seconds)
-        time.sleep(record_time)
+        # 5. Wait for the specified record_time (in seconds), reporting anything the
+        #    server sends in the meantime
+        self.flush()
+        self.wait(record_time)
 
         # 6. Stop the recording
-        self.send_command("set runmode stop")
+        self.send_command(STOP)
+        self.flush()
         print("Recording stopped.")
 
         print("Recording completed. An .rhs file should be in the directory:")
@@ -1,8 +1,23 @@
-import os
-import csv
 import time
-from datetime import datetime
-from TCP import RHX_TCPClient
+from utils.TCP import RHX_TCPClient, RUN, STOP
+from utils.log_time import create_csv_logger, log_to_csv
+
+# Per-channel stimulation settings, filled in by configure_channel
+_STIM_CMD_TEMPLATES = (
+    "set {ch}.stimenabled true",
+    "set {ch}.shape biphasic",
+    "set {ch}.polarity {polarity}",
+    "set {ch}.source KeyPressF1",  # Trigger source
+    "set {ch}.firstphasedurationmicroseconds {phase_duration_us}",
+    "set {ch}.secondphasedurationmicroseconds {phase_duration_us}",
+    "set {ch}.interphasedelaymicroseconds {interphase_delay_us}",
+    "set {ch}.firstphaseamplitudemicroamps {amplitude_ua}",
+    "set {ch}.secondphaseamplitudemicroamps {amplitude_ua}",
+    # Set the number of stimulation pulses
+    "set {ch}.numberofstimpulses 255",
+    # Set the pulse train period to achieve the desired frequency
+    "set {ch}.pulsetrainperiodmicroseconds {period_us}",
+)
 
 def run_ti_dipole_stimulation(
     channel_a, 
@@ -63,67 +78,47 @@ def run_ti_dipole_stimulation(
     # Helper Functions
     # ======================================================================
 
-    def create_csv_logger(output_folder):
-        if not os.path.exists(output_folder):
-            os.makedirs(output_folder)
-        filename = datetime.now().strftime("%Y-%m-%d_%H-%M-%S") + ".csv"
-        filepath = os.path.join(output_folder, filename)
-        with open(filepath, mode='w', newline='') as file:
-            writer = csv.writer(file)
-            writer.writerow(["Date-Time", "Channel", "Frequency (Hz)", "Amplitude (uA)"])
-        return filepath
-
-    def log_to_csv(filepath, channel, freq, amplitude):
-        with open(filepath, mode='a', newline='') as file:
-            writer = csv.writer(file)
-            writer.writerow([datetime.now().strftime("%Y-%m-%d %H:%M:%S"), channel, freq, amplitude])
-
-    def configure_channel(client, channel, amplitude_ua, phase_duration_us, interphase_delay_us, period_us, polarity):
-        # Configure a single channel for stimulation
-        client.send_command(f"set {channel}.stimenabled true")
-        client.send_command(f"set {channel}.shape biphasic")
-        client.send_command(f"set {channel}.polarity {polarity}")
-        client.send_command(f"set {channel}.source KeyPressF1")  # Trigger source
-        client.send_command(f"set {channel}.firstphasedurationmicroseconds {phase_duration_us}")
-        client.send_command(f"set {channel}.secondphasedurationmicroseconds {phase_duration_us}")
-        client.send_command(f"set {channel}.interphasedelaymicroseconds {interphase_delay_us}")
-        client.send_command(f"set {channel}.firstphaseamplitudemicroamps {amplitude_ua}")
-        client.send_command(f"set {channel}.secondphaseamplitudemicroamps {amplitude_ua}")
-        # Set the number of stimulation pulses
-        client.send_command(f"set {channel}.numberofstimpulses 255")
-        # Set the pulse train period to achieve the desired frequency
-        client.send_command(f"set {channel}.pulsetrainperiodmicroseconds {period_us}")
+    def configure_channel(channel, amplitude_ua, phase_duration_us, interphase_delay_us, period_us, polarity):
+        # Commands configuring a single channel for stimulation
+        fields = dict(ch=channel, amplitude_ua=amplitude_ua, phase_duration_us=phase_duration_us,
+                      interphase_delay_us=interphase_delay_us, period_us=period_us, polarity=polarity)
+        return [t.format(**fields).encode('utf-8') for t in _STIM_CMD_TEMPLATES]
 
     # ======================================================================
     # Main Stimulation Routine
     # ======================================================================
     client = RHX_TCPClient(host=HOST, port=PORT)
-    csv_file = create_csv_logger(OUTPUT_FOLDER)
+    # Kept open for the whole stimulation; closed alongside the client
+    csv_file = create_csv_logger(OUTPUT_FOLDER, ["Channel", "Frequency (Hz)", "Amplitude (uA)"])
 
     try:
         # Disable all channels before configuring
-        for ch in [channel_a, channel_b, return_channel_a, return_channel_b]:
-            client.send_command(f"set {ch}.stimenabled false")
+        cmds = [f"set {ch}.stimenabled false".encode('utf-8')
+                for ch in [channel_a, channel_b, return_channel_a, return_channel_b]]
 
         # Configure the main (source) channels with PositiveFirst polarity
-        configure_channel(client, channel_a, amplitude_ua1, PHASE_DURATION_US, INTERPHASE_DELAY_US, PERIOD_A_US, "PositiveFirst")
-        configure_channel(client, channel_b, amplitude_ua2, PHASE_DURATION_US, INTERPHASE_DELAY_US, PERIOD_B_US, "PositiveFirst")
+        cmds += configure_channel(channel_a, amplitude_ua1, PHASE_DURATION_US, INTERPHASE_DELAY_US, PERIOD_A_US, "PositiveFirst")
+        cmds += configure_channel(channel_b, amplitude_ua2, PHASE_DURATION_US, INTERPHASE_DELAY_US, PERIOD_B_US, "PositiveFirst")
 
         # Configure the return channels with NegativeFirst polarity
-        configure_channel(client, return_channel_a, amplitude_ua1, PHASE_DURATION_US, INTERPHASE_DELAY_US, PERIOD_A_US, "NegativeFirst")
-        configure_channel(client, return_channel_b, amplitude_ua2, PHASE_DURATION_US, INTERPHASE_DELAY_US, PERIOD_B_US, "NegativeFirst")
+        cmds += configure_channel(return_channel_a, amplitude_ua1, PHASE_DURATION_US, INTERPHASE_DELAY_US, PERIOD_A_US, "NegativeFirst")
+        cmds += configure_channel(return_channel_b, amplitude_ua2, PHASE_DURATION_US, INTERPHASE_DELAY_US, PERIOD_B_US, "NegativeFirst")
 
         # Upload parameters
-        client.send_command("execute uploadstimparameters")
+        cmds.append(b"execute uploadstimparameters")
+
+        # Send the whole configuration in one block
+        client.send_commands(cmds)
 
         # Log channel settings (source first, then return)
         log_to_csv(csv_file, channel_a, FREQ_A, amplitude_ua1)
         log_to_csv(csv_file, channel_b, FREQ_B, amplitude_ua2)
         log_to_csv(csv_file, return_channel_a, FREQ_A, amplitude_ua1)
         log_to_csv(csv_file, return_channel_b, FREQ_B, amplitude_ua2)
+        csv_file.flush()
 
         # Start running the system
-        client.send_command("set runmode run")
+        client.send_command(RUN)
 
         # Trigger both channels (and their returns) simultaneously
         client.send_command("execute manualstimtriggerpulse F1")
@@ -133,10 +128,11 @@ def run_ti_dipole_stimulation(
         print(f"  Source: {channel_b} (+{amplitude_ua2} µA), Return: {return_channel_b} (opposite)")
         print(f"for {STIMULATION_TIME} s...")
 
+        client.flush()
         time.sleep(STIMULATION_TIME)
 
         # Stop the stimulation
-        client.send_command("set runmode stop")
+        client.send_command(STOP)
 
         # Disable the channels after stopping
         for ch in [channel_a, channel_b, return_channel_a, return_channel_b]:
@@ -148,3 +144,4 @@ def run_ti_dipole_stimulation(
         print("Process interrupted by user.")
     finally:
         client.close()
+        csv_file.close()
@@ -0,0 +1,40 @@
+'''
+CSV logging for the stimulation scripts: one timestamped log file per run, with
+one row per channel configuration.
+'''
+
+import csv
+import os
+import time
+
+# Rows are buffered and written out when the caller flushes the file
+LOG_BUFFER_SIZE = 8192
+
+# Last formatted log timestamp, reused while rows land in the same second
+_ts_cache = (None, "")
+
+def timestamp():
+    """Current local time as 'YYYY-mm-dd HH:MM:SS', formatted at most once per second."""
+    global _ts_cache
+    sec = int(time.time())
+    if sec != _ts_cache[0]:
+        _ts_cache = (sec, time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(sec)))
+    return _ts_cache[1]
+
+def create_csv_logger(output_folder, columns):
+    """
+    Open a new log file named after the current time in output_folder and write
+    the header row: "Date-Time" followed by `columns`. The file is kept open for
+    the whole run; flush it at sync points and close it when done.
+    """
+    os.makedirs(output_folder, exist_ok=True)
+    filename = time.strftime("%Y-%m-%d_%H-%M-%S") + ".csv"
+    filepath = os.path.join(output_folder, filename)
+    file = open(filepath, mode='a', newline='', buffering=LOG_BUFFER_SIZE)
+    csv.writer(file).writerow(["Date-Time", *columns])
+    return file
+
+def log_to_csv(file, *fields):
+    """Write one row: the current timestamp followed by `fields`."""
+    # Fields never contain commas or quotes, so rows are written directly
+    file.write(",".join([timestamp(), *map(str, fields)]) + "\r\n")
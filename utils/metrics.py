@@ -0,0 +1,113 @@
+'''
+Signal metrics for the TI feedback loop, and the conversion of raw Intan
+amplifier samples to microvolts.
+
+Numba is optional: if it isn't installed the kernels below run as plain
+Python, giving the same results but much more slowly on long windows.
+'''
+
+import math
+import numpy as np
+
+try:
+    from numba import njit, prange
+except ImportError:
+    def njit(*args, **kwargs):
+        # No-op stand-in supporting both @njit and @njit(...)
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+        return lambda fn: fn
+    prange = range
+
+# Intan amplifier samples are offset binary with 0.195 uV per bit
+AMPLIFIER_OFFSET = 32768
+AMPLIFIER_UV_PER_BIT = 0.195
+
+# float32 copies for amplifier_to_microvolts, so its arithmetic stays in float32
+_OFFSET_F32 = np.float32(AMPLIFIER_OFFSET)
+_UV_PER_BIT_F32 = np.float32(AMPLIFIER_UV_PER_BIT)
+
+# Explicit signature: compiled when this module is imported, not on the first call
+@njit("float64[:](float64[:,:], float64, float64)", parallel=True, fastmath=True, cache=True)
+def modulation_index(amp_data, carrier_hz, fs):
+    """
+    Modulation index of each channel at a single tone frequency.
+
+    Uses the Goertzel algorithm to get the magnitude of the `carrier_hz`
+    component (no FFT needed for one frequency) and normalises it by the
+    channel's RMS after removing the mean, so a pure tone at `carrier_hz`
+    gives ~1 and a channel with no energy at that frequency gives ~0.
+    Channels are processed in parallel.
+
+    Parameters
+    ----------
+    amp_data : np.ndarray
+        float64 array shaped as (num_channels, num_samples).
+    carrier_hz : float
+        Frequency of interest, e.g. the 50 Hz TI beat frequency.
+    fs : float
+        Sample rate in Hz.
+
+    Returns
+    -------
+    np.ndarray
+        float64 array of length num_channels.
+    """
+    num_channels, num_samples = amp_data.shape
+    out = np.zeros(num_channels)
+    coeff = 2.0 * math.cos(2.0 * math.pi * carrier_hz / fs)
+
+    for c in prange(num_channels):
+        mean = 0.0
+        for t in range(num_samples):
+            mean += amp_data[c, t]
+        mean /= num_samples
+
+        # Goertzel recurrence, accumulating the total power alongside it
+        s1 = 0.0
+        s2 = 0.0
+        power = 0.0
+        for t in range(num_samples):
+            x = amp_data[c, t] - mean
+            s0 = x + coeff * s1 - s2
+            s2 = s1
+            s1 = s0
+            power += x * x
+
+        # |X(carrier)|^2; tone amplitude is 2|X|/N and RMS is sqrt(power/N),
+        # so amplitude / (sqrt(2) * RMS) simplifies to the expression below
+        tone = s1 * s1 + s2 * s2 - coeff * s1 * s2
+        if power > 0.0:
+            out[c] = math.sqrt(2.0 * tone / (num_samples * power))
+
+    return out
+
+
+# No signature: compiled on first use, so importing this module doesn't pay for it
+@njit(parallel=True, fastmath=True, cache=True)
+def amplifier_to_microvolts(raw, out):
+    """
+    Convert raw amplifier samples to microvolts, writing them into `out`.
+
+    Works directly on the uint16 data (e.g. read_intan_rhs_file's
+    amplifier_data, or a memory-mapped view of it) in one pass, without the
+    temporary arrays that `(raw.astype(np.float32) - 32768) * 0.195` makes.
+    Channels are processed in parallel.
+
+    Parameters
+    ----------
+    raw : np.ndarray
+        uint16 array shaped as (num_channels, num_samples).
+    out : np.ndarray
+        float32 array of the same shape, overwritten with the result.
+
+    Returns
+    -------
+    np.ndarray
+        `out`.
+    """
+    num_channels, num_samples = raw.shape
+    for c in prange(num_channels):
+        for t in range(num_samples):
+            out[c, t] = (np.float32(raw[c, t]) - _OFFSET_F32) * _UV_PER_BIT_F32
+    return out
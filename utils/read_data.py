@@ -1,7 +1,22 @@
+import mmap
 import struct
+import functools
 import numpy as np
 import os
 
+# Header fields, unpacked with precompiled formats
+_U32 = struct.Struct('<I').unpack
+_F = struct.Struct('<f').unpack
+_H = struct.Struct('<h').unpack
+_HH = struct.Struct('<hh').unpack
+_HHH = struct.Struct('<hhh').unpack
+
+# Fixed-size part of each channel record in the header: the channel metadata
+# (signal type and enabled flag at indices 2 and 3), then 8 bytes of trigger
+# fields and 8 bytes of impedance fields that we skip
+_CHAN_RHD = struct.Struct('<hhhhhh16x')
+_CHAN_RHS = struct.Struct('<hhhhhhh16x')
+
 ###############################################################################
 # Basic read_header function
 ###############################################################################
@@ -26,7 +41,7 @@ def read_header(filename):
     rhd = (filetype == 'rhd')
 
     # Check magic number
-    magic_number, = struct.unpack('<I', fid.read(4))
+    magic_number, = _U32(fid.read(4))
     correct_magic_number = int('c6912702', 16) if rhd else int('d69127ac', 16)
     if magic_number != correct_magic_number:
         raise ValueError("Unrecognized file type magic number.")
@@ -35,11 +50,11 @@ def read_header(filename):
     header['filename'] = filename
 
     # Read version
-    version_major, version_minor = struct.unpack('<hh', fid.read(4))
+    version_major, version_minor = _HH(fid.read(4))
     header['version'] = {'major': version_major, 'minor': version_minor}
 
     # Read sample rate
-    sample_rate, = struct.unpack('<f', fid.read(4))
+    sample_rate, = _F(fid.read(4))
     header['sample_rate'] = sample_rate
 
     # Skip a bunch of fields that are in the original code,
@@ -57,52 +72,44 @@ def read_header(filename):
         fid.seek(8 + 4 + 12, 1)
 
     # Read the 3 note strings (we won't do anything with them here)
-    _ = _read_qstring(fid)  # note1
-    _ = _read_qstring(fid)  # note2
-    _ = _read_qstring(fid)  # note3
+    _skip_qstring(fid)  # note1
+    _skip_qstring(fid)  # note2
+    _skip_qstring(fid)  # note3
 
     if rhd:
         # skip potential temperature sensors, board mode, etc.
         fid.seek(4, 1)
         # If version > 1, might have reference channel string:
         if version_major > 1:
-            _ = _read_qstring(fid)
+            _skip_qstring(fid)
     else:
         # skip 4 bytes (dc_amplifier_data_saved, eval_board_mode)
         fid.seek(4, 1)
         # skip reference channel
-        _ = _read_qstring(fid)
+        _skip_qstring(fid)
 
     # Create dictionary entries
     header['amplifier_channels'] = []
     header['num_amplifier_channels'] = 0
 
     # The code now reads how many signal groups are present
-    number_of_signal_groups, = struct.unpack('<h', fid.read(2))
+    number_of_signal_groups, = _H(fid.read(2))
+    chan_struct = _CHAN_RHD if rhd else _CHAN_RHS
 
     for _ in range(number_of_signal_groups):
-        signal_group_name = _read_qstring(fid)
-        signal_group_prefix = _read_qstring(fid)
-        signal_group_enabled, signal_group_num_channels, _ = struct.unpack(
-            '<hhh', fid.read(6)
-        )
+        _skip_qstring(fid)  # signal group name
+        _skip_qstring(fid)  # signal group prefix
+        signal_group_enabled, signal_group_num_channels, _ = _HHH(fid.read(6))
 
         if (signal_group_num_channels > 0) and (signal_group_enabled > 0):
             for _ in range(signal_group_num_channels):
                 native_chan_name = _read_qstring(fid)
                 custom_chan_name = _read_qstring(fid)
-                # read some channel metadata
-                if rhd:
-                    unpacked = struct.unpack('<hhhhhh', fid.read(12))
-                    signal_type = unpacked[2]
-                    channel_enabled = unpacked[3]
-                else:
-                    unpacked = struct.unpack('<hhhhhhh', fid.read(14))
-                    signal_type = unpacked[2]
-                    channel_enabled = unpacked[3]
-
-                # skip trigger fields, impedance fields
-                fid.seek(8 + 8, 1)
+                # read some channel metadata, skipping the trigger and impedance
+                # fields that follow it in the same read
+                unpacked = chan_struct.unpack(fid.read(chan_struct.size))
+                signal_type = unpacked[2]
+                channel_enabled = unpacked[3]
 
                 # We only care about “amplifier” type signals here (signal_type == 0).
                 if channel_enabled and (signal_type == 0):
@@ -117,7 +124,8 @@ def read_header(filename):
     # At this point, we've read all the header info we need.
     # Next "header['fid'].tell()" is the place where data blocks begin.
     header['data_start_byte'] = fid.tell()
-    header['total_file_size'] = os.path.getsize(filename)
+    # Size from the open file itself, rather than looking the path up again
+    header['total_file_size'] = os.fstat(fid.fileno()).st_size
 
     # For .rhs, each data block has 128 samples
     header['num_samples_per_data_block'] = 128 if not rhd else 60
@@ -127,25 +135,67 @@ def read_header(filename):
     return header
 
 
+@functools.lru_cache(maxsize=4)
+def _read_header_at(filename, st_dev, st_ino):
+    """
+    read_header, memoized per file (path plus device and inode numbers).
+    The file size is dropped: it changes as a recording grows while the
+    header bytes don't, so readers take it from the file they open.
+    """
+    header = read_header(filename)
+    del header['total_file_size']
+    return header
+
+
+def _cached_header(filename):
+    """
+    Return the parsed header for filename, re-parsing only when the path
+    refers to a different file (e.g. a new recording saved under the same
+    name). Writes that grow the file keep the cached header, so it has no
+    'total_file_size'. The dict is shared between callers, so it must not
+    be mutated.
+    """
+    st = os.stat(filename)
+    return _read_header_at(filename, st.st_dev, st.st_ino)
+
+
+def _advise_sequential(fid, offset, length):
+    """
+    Hint that bytes [offset, offset + length) of fid are about to be read
+    sequentially, so the kernel reads ahead further and starts straight away.
+    Does nothing where posix_fadvise isn't available (e.g. Windows).
+    """
+    try:
+        os.posix_fadvise(fid.fileno(), offset, length, os.POSIX_FADV_SEQUENTIAL)
+        os.posix_fadvise(fid.fileno(), offset, length, os.POSIX_FADV_WILLNEED)
+    except AttributeError:
+        pass
+
+
 def _read_qstring(fid):
     """Utility to read a Qt style QString. We only do the minimal version of it."""
-    length, = struct.unpack('<I', fid.read(4))
+    length, = _U32(fid.read(4))
     if length == 0xFFFFFFFF:
         return ""
-    length = length // 2  # since it's 16-bit Unicode
-    data = []
-    for _ in range(length):
-        c, = struct.unpack('<H', fid.read(2))
-        data.append(c)
-    return ''.join(chr(c) for c in data)
+    # 16-bit Unicode, little-endian: decode all `length` bytes in one go
+    return fid.read(length).decode('utf-16-le')
+
+
+def _skip_qstring(fid):
+    """Move past a QString whose value isn't needed, without decoding it."""
+    length, = _U32(fid.read(4))
+    if length != 0xFFFFFFFF:
+        fid.seek(length, 1)
 
 
 ###############################################################################
 # Simplified data-reading function
 ###############################################################################
-def read_intan_rhs_file(file_path):
+def read_intan_rhs_file(file_path, microvolts=False):
     """
     Read an Intan .rhs file's header + a single big block of amplifier data.
+    If `microvolts` is True, the amplifier data is returned converted to
+    microvolts (float32) instead of as raw uint16 samples.
     Returns:
     --------
     data : dict
@@ -158,62 +208,62 @@ def read_intan_rhs_file(file_path):
     # -------------------------------------------------------------------------
     # 1) Read the header
     # -------------------------------------------------------------------------
-    header = read_header(file_path)
+    # A copy of the cached header, since callers may add to it
+    header = dict(_cached_header(file_path))
     num_channels = header['num_amplifier_channels']
     samples_per_block = header['num_samples_per_data_block']
 
-    # Figure out how many data blocks are present. Each block is:
-    #   - 4 bytes per sample for the timestamp (128 samples -> 128 * 4 = 512 bytes)
-    #   - plus 2 bytes per amplifier channel per sample
-    #   - plus other signals we skip, but for .rhs we at least must skip
-    #     DC amps, stim, board ADCs, etc.  
-    # For simplicity, let's compute total blocks by dividing leftover file size
-    # by the known block size. This is a minimal approach (the real code checks more).
-    bytes_per_block = _get_bytes_per_data_block(header)
-    data_size_bytes = header['total_file_size'] - header['data_start_byte']
-    num_data_blocks = data_size_bytes // bytes_per_block
+    # Figure out how many data blocks are present. The layout of a block is
+    # worked out once, as a structured dtype (timestamps, amplifier data, then
+    # the DC amps, stim, board ADCs, etc. that we skip), and everything below
+    # comes from it. For simplicity, let's compute total blocks by dividing
+    # leftover file size by the block size. This is a minimal approach (the
+    # real code checks more).
+    block_dtype = _block_dtype(header)
+    bytes_per_block = block_dtype.itemsize
+
+    with open(file_path, 'rb') as fid:
+        # The cached header has no size (the file may still be growing), so
+        # take it from the file we're about to read
+        header['total_file_size'] = os.fstat(fid.fileno()).st_size
+        data_size_bytes = header['total_file_size'] - header['data_start_byte']
+        num_data_blocks = data_size_bytes // bytes_per_block
+
+        total_samples = num_data_blocks * samples_per_block
+
+        # ---------------------------------------------------------------------
+        # 2) Map the data blocks and gather the amplifier data from every block
+        # ---------------------------------------------------------------------
+        # With the block dtype, the whole data region can be viewed as an array
+        # of blocks in a memory mapping instead of being read one block at a time.
+        # We'll store raw data (uint16) for each channel x time. Every sample is
+        # written below, so the array isn't zero-filled first.
+        amplifier_data = np.empty((num_channels, total_samples), dtype=np.uint16)
+        if num_data_blocks:
+            with mmap.mmap(fid.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                # The data region is read front to back, so ask the kernel for
+                # aggressive readahead, on the file and on the mapping's page faults
+                _advise_sequential(fid, header['data_start_byte'], data_size_bytes)
+                if hasattr(mmap, 'MADV_SEQUENTIAL'):
+                    mm.madvise(mmap.MADV_SEQUENTIAL)
+                blocks = np.frombuffer(mm, dtype=block_dtype, count=num_data_blocks,
+                                       offset=header['data_start_byte'])
+                # Copy (blocks, channels, samples) straight from the page cache
+                # into a (channels, blocks, samples) view of the output, which is
+                # (channels, blocks * samples) in memory
+                amplifier_data.reshape(num_channels, num_data_blocks, samples_per_block)[...] = \
+                    blocks['amplifier'].transpose(1, 0, 2)
+                # The mapping can only be closed once no array refers to it
+                del blocks
+
+    if microvolts:
+        # Converted in one pass into a float32 array, without numpy temporaries
+        from utils.metrics import amplifier_to_microvolts
+        amplifier_data = amplifier_to_microvolts(
+            amplifier_data, np.empty(amplifier_data.shape, dtype=np.float32))
 
-    total_samples = num_data_blocks * samples_per_block
-
-    # -------------------------------------------------------------------------
-    # 2) Prepare an array for amplifier data
     # -------------------------------------------------------------------------
-    # We'll store raw data (uint16) for each channel x time
-    amplifier_data = np.zeros((num_channels, total_samples), dtype=np.uint16)
-
-    # -------------------------------------------------------------------------
-    # 3) Read the file again (or re-seek) to parse the amplifier data
-    # -------------------------------------------------------------------------
-    fid = open(file_path, 'rb')
-    fid.seek(header['data_start_byte'], 0)  # move to start of data
-
-    # We skip reading timestamps, stim, etc. and only read amplifier data
-    # from each block
-    read_offset = 0
-    for _ in range(num_data_blocks):
-        # Skip timestamp (4 bytes per sample * samples_per_block)
-        fid.seek(4 * samples_per_block, 1)
-
-        # Read amplifier data from this block
-        # shape is (samples_per_block * num_channels) in 16-bit integers
-        block_values = np.fromfile(fid, dtype=np.uint16,
-                                   count=samples_per_block * num_channels)
-        # Reshape
-        block_values = block_values.reshape(num_channels, samples_per_block)
-        # Insert into final array
-        amplifier_data[:, read_offset:read_offset + samples_per_block] = block_values
-
-        # For .rhs files, there's more data after the amplifier block (DC amplifier, etc.).
-        # We have to skip it. We'll do a minimal skip based on the formula:
-        skip_this = _rhs_skip_after_amplifier(header)
-        fid.seek(skip_this, 1)
-
-        read_offset += samples_per_block
-
-    fid.close()
-
-    # -------------------------------------------------------------------------
-    # 4) Bundle data into a dictionary and return
+    # 3) Bundle data into a dictionary and return
     # -------------------------------------------------------------------------
     data = {
         'amplifier_data': amplifier_data
@@ -221,50 +271,109 @@ def read_intan_rhs_file(file_path):
     return data, header
 
 
-def _get_bytes_per_data_block(header):
+def read_many(paths, workers=None):
     """
-    Minimal version of block size calculation for .rhs (not fully robust, 
-    but enough to demonstrate the concept).
+    Read several .rhs files with read_intan_rhs_file in parallel worker
+    processes, yielding (data, header) for each path in order.
+    Every amplifier array is pickled back from its worker, so for very large
+    files it can be cheaper to process each file inside the worker instead.
+    The header's (closed) 'fid' can't be sent between processes and is left out.
     """
-    # For RHS:
-    #   - 4 bytes * 128 samples for the timestamps
-    #   - 2 bytes * (num_amplifier_channels) * 128 for amplifier
-    #   - THEN we also have DC amplifier data, stim data, board ADC data, etc.
-    # In real code, you'd compute it carefully. Here, we'll do a minimal approach:
-    base = 128 * 4  # timestamps
-    base += 128 * 2 * header['num_amplifier_channels']  # amplifier
-    # Let's guess-skip the rest for demonstration’s sake. The real code is more complex.
-    # We'll do a big number to reflect DC amps + stim + ADC + DIG
-    # That number is gleaned from the official code or from the Intan docs
-    # For demonstration, let's just approximate:
-    #   DC amplifier: 128 samples * 2 bytes * numAmplifiers
-    #   stim data:    128 samples * 2 bytes * numAmplifiers
-    #   plus board ADC, dig in/out, etc. We'll just pretend ~ (some constant times 128).
-    # This is just a placeholder for demonstration.
-    base += 128 * 2 * header['num_amplifier_channels']  # DC
-    base += 128 * 2 * header['num_amplifier_channels']  # stim
-    # approximate for board ADC, DAC, dig etc.
-    # Let’s do a small constant
-    base += 128 * 2 * 2   # pretend 2 board ADC channels
-    base += 128 * 2 * 2   # pretend dig in/out lumps
-    return base
-
-
-def _rhs_skip_after_amplifier(header):
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        yield from ex.map(_read_without_fid, paths, chunksize=1)
+
+
+def _read_without_fid(file_path):
+    """read_intan_rhs_file for read_many's workers."""
+    data, header = read_intan_rhs_file(file_path)
+    header.pop('fid', None)
+    return data, header
+
+
+# Read buffer reused by read_intan_rhs_tail, grown to the largest tail read so far
+_tail_buf = bytearray()
+
+
+def read_intan_rhs_tail(file_path, num_samples=1):
+    """
+    Read only the last `num_samples` amplifier samples of an Intan .rhs file.
+    The final data blocks are read directly with a single read, so the cost
+    does not grow with the length of the recording.
+    Returns:
+    --------
+    amplifier_data : np.ndarray
+        uint16 array shaped as (num_channels, num_samples), or fewer samples
+        if the file doesn't hold that many yet.
+    header : dict
+        The header dictionary returned by read_header, without
+        'total_file_size' (cached; don't mutate).
+    """
+    global _tail_buf
+
+    header = _cached_header(file_path)
+    num_channels = header['num_amplifier_channels']
+    samples_per_block = header['num_samples_per_data_block']
+
+    block_dtype = _block_dtype(header)
+    bytes_per_block = block_dtype.itemsize
+
+    with open(file_path, 'rb', buffering=0) as fid:
+        # The file grows while RHX records; take its current size from the open file
+        data_size_bytes = os.fstat(fid.fileno()).st_size - header['data_start_byte']
+        num_data_blocks = data_size_bytes // bytes_per_block
+
+        # Only read the trailing blocks that contain the requested samples
+        num_tail_blocks = min(num_data_blocks, -(-num_samples // samples_per_block))
+        if num_tail_blocks == 0:
+            return np.empty((num_channels, 0), dtype=np.uint16), header
+        offset = header['data_start_byte'] + (num_data_blocks - num_tail_blocks) * bytes_per_block
+
+        # One read into a buffer kept between calls (this runs every loop iteration)
+        nbytes = num_tail_blocks * bytes_per_block
+        if len(_tail_buf) < nbytes:
+            _tail_buf = bytearray(nbytes)
+        view = memoryview(_tail_buf)[:nbytes]
+        fid.seek(offset)
+        while view:
+            n = fid.readinto(view)
+            if not n:
+                raise EOFError(f"{file_path} ended inside a data block")
+            view = view[n:]
+    blocks = np.frombuffer(_tail_buf, dtype=block_dtype, count=num_tail_blocks)
+
+    # Copy (blocks, channels, samples) out of the buffer as (channels, blocks * samples)
+    amp = np.empty((num_channels, num_tail_blocks * samples_per_block), dtype=np.uint16)
+    amp.reshape(num_channels, num_tail_blocks, samples_per_block)[...] = \
+        blocks['amplifier'].transpose(1, 0, 2)
+    amplifier_data = amp[:, -num_samples:]
+    return amplifier_data, header
+
+
+@functools.lru_cache(maxsize=None)
+def _rhs_block_dtype(num_amp, samples_per_block=128, num_adc=2, num_dig=2):
     """
-    Once we read the amplifier data from each block, we must skip 
-    the remainder of that block (DC amplifier, stim, board ADC, dig).
-    This function calculates how many bytes to skip. 
+    Layout of one .rhs data block as a structured dtype, so the block size and
+    the position of every signal come from one place. Minimal version (not
+    fully robust, but enough to demonstrate the concept): the board ADC and
+    digital in/out counts are assumed rather than read from the header.
+    Signals are stored channel by channel within the block.
     """
-    # Since we did a minimal read of only amplifier data, let's skip
-    #   DC amps + stim + board ADC + board dig in/out
-    # For demonstration, we’ll match what we added in `_get_bytes_per_data_block`
-    # after the amplifier data.
-    skip_bytes_for_dc = 128 * 2 * header['num_amplifier_channels']
-    skip_bytes_for_stim = 128 * 2 * header['num_amplifier_channels']
-    skip_bytes_for_adcs = 128 * 2 * 2
-    skip_bytes_for_digs = 128 * 2 * 2
-    return skip_bytes_for_dc + skip_bytes_for_stim + skip_bytes_for_adcs + skip_bytes_for_digs
+    return np.dtype([
+        ('timestamps', '<i4', (samples_per_block,)),
+        ('amplifier', '<u2', (num_amp, samples_per_block)),
+        ('dc', '<u2', (num_amp, samples_per_block)),         # DC amplifier
+        ('stim', '<u2', (num_amp, samples_per_block)),
+        ('adc', '<u2', (num_adc, samples_per_block)),        # board ADC
+        ('dig', '<u2', (num_dig, samples_per_block)),        # dig in/out lumps
+    ])
+
+
+def _block_dtype(header):
+    """The _rhs_block_dtype for the file described by header."""
+    return _rhs_block_dtype(header['num_amplifier_channels'],
+                            header['num_samples_per_data_block'])
 
 
 ###############################################################################
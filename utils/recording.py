@@ -2,14 +2,30 @@
 example script on how to use the recording function in the TCP class
 '''
 
+import argparse
+
 from TCP import RHX_TCPClient
 
-# Initialize the client (commands server)
-client = RHX_TCPClient(host='127.0.0.1', port=5000)
 
-# Perform the recording (for 10 seconds, data directory "data/")
-# Data enabling and run control is handled inside the recording method.
-client.recording(record_time=10, base_directory=r"C:\Users\eddyt\Documents\Intan recordings")
+def main():
+    parser = argparse.ArgumentParser(description="Record an .rhs file through the RHX TCP command server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--record-time", type=float, default=10, help="seconds to record for")
+    parser.add_argument("--dir", default=r"C:\Users\eddyt\Documents\Intan recordings",
+                        help="base directory the recording folder is created in")
+    args = parser.parse_args()
+
+    # Initialize the client (commands server)
+    client = RHX_TCPClient(host=args.host, port=args.port)
+
+    # Perform the recording (for 10 seconds by default)
+    # Data enabling and run control is handled inside the recording method.
+    client.recording(record_time=args.record_time, base_directory=args.dir)
+
+    # Close the connection
+    client.close()
+
 
-# Close the connection
-client.close()
+if __name__ == "__main__":
+    main()